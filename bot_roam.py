@@ -4,10 +4,14 @@ import os
 from datetime import datetime
 from decimal import Decimal, ROUND_DOWN, InvalidOperation
 from typing import Optional, List, Dict
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+from multiprocessing.sharedctypes import RawArray
 import signal
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from flask import Flask
 
 # ==========================================================
@@ -43,8 +47,19 @@ SEND_STARTUP_MESSAGE = True
 HEARTBEAT_INTERVAL_SEC = 300
 SELF_PING_INTERVAL_SEC = 240  # Ping mỗi 4 phút để giữ Render service active
 
+# Transport
+RPC_POOL_MAXSIZE = 4
+RPC_KEEPALIVE_INTERVAL_SEC = 45  # Giữ ấm connection tới các RPC dự phòng đang idle
+RPC_WARMUP_TIMEOUT_SEC = 5
+
 PORT = int(os.environ.get("PORT", 10000))
 
+# Serving mode: "dev" = Flask dev server cùng process với watcher,
+# "prod" = gunicorn workers + watcher chạy ở process riêng
+SERVE_MODE = os.environ.get("SERVE_MODE", "dev").lower()
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 2))
+WATCHER_CHECK_INTERVAL_SEC = 10
+
 # Tự động detect URL từ Render
 def get_render_url():
     """Tự động lấy URL của service từ Render environment"""
@@ -75,7 +90,67 @@ log = logging.getLogger("ROAM_WATCHDOG")
 # GLOBALS
 # ==========================================================
 shutdown_event = Event()
-last_activity = {"time": datetime.now(), "type": "startup"}
+
+# ==========================================================
+# SHARED STATE
+# ==========================================================
+ACTIVITY_TYPES = ["startup", "telegram_sent", "sol_rpc", "bsc_rpc", "bsc_poll", "ping"]
+SNAPSHOT_FIELDS = [
+    "activity_time", "activity_type",
+    "sol_success", "sol_fail", "bsc_success", "bsc_fail", "telegram_sent",
+    "watcher_pid", "rpc_pool_peak", "rpc_pool_overflow",
+]
+SNAPSHOT_READ_RETRIES = 100
+
+class SharedSnapshot:
+    """Snapshot trạng thái dùng chung giữa watcher process và HTTP workers.
+
+    Dữ liệu nằm trong shared memory (RawArray) được tạo trước khi fork.
+    Chỉ một process được ghi (watcher, hoặc process duy nhất ở dev mode),
+    nên lock chỉ cần là threading.Lock giữa các thread của process đó.
+    Writer tăng sequence lên số lẻ trước khi ghi và số chẵn sau khi ghi (seqlock),
+    reader không cần khóa, chỉ đọc lại nếu sequence thay đổi.
+    """
+    def __init__(self):
+        self._buf = RawArray("d", 1 + len(SNAPSHOT_FIELDS))
+        self._write_lock = Lock()
+        self._writer_pid = os.getpid()
+        self.update(activity_time=time.time(), activity_type=0)
+
+    def is_writer(self) -> bool:
+        return os.getpid() == self._writer_pid
+
+    def claim_writer(self):
+        """Gọi trong watcher process để nhận quyền ghi snapshot"""
+        self._writer_pid = os.getpid()
+        # Watcher trước có thể chết giữa lúc ghi, để lại sequence lẻ
+        if int(self._buf[0]) % 2:
+            self._buf[0] += 1
+        self.update(watcher_pid=os.getpid())
+
+    def update(self, **fields) -> bool:
+        """Ghi snapshot; trả về False (không ghi) nếu không phải writer process"""
+        if not self.is_writer():
+            return False
+        with self._write_lock:
+            self._buf[0] += 1
+            for name, value in fields.items():
+                self._buf[1 + SNAPSHOT_FIELDS.index(name)] = float(value)
+            self._buf[0] += 1
+        return True
+
+    def read(self) -> dict:
+        for _ in range(SNAPSHOT_READ_RETRIES):
+            seq = self._buf[0]
+            if int(seq) % 2 == 0:
+                values = self._buf[1:]
+                if self._buf[0] == seq:
+                    return dict(zip(SNAPSHOT_FIELDS, values))
+            time.sleep(0)
+        # Không lấy được bản nhất quán: trả về giá trị hiện có thay vì treo request
+        return dict(zip(SNAPSHOT_FIELDS, self._buf[1:]))
+
+shared_state = SharedSnapshot()
 
 # ==========================================================
 # HELPERS
@@ -106,8 +181,143 @@ def pad_address_topic(addr: str) -> str:
     return "0x" + ("0" * 48) + a
 
 def update_activity(activity_type: str):
-    last_activity["time"] = datetime.now()
-    last_activity["type"] = activity_type
+    shared_state.update(activity_time=time.time(),
+                        activity_type=ACTIVITY_TYPES.index(activity_type))
+
+def watcher_alive() -> bool:
+    """False nếu watcher process (prod mode) đã chết; dev mode luôn True"""
+    pid = int(shared_state.read()["watcher_pid"])
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def get_last_activity() -> dict:
+    snap = shared_state.read()
+    return {
+        "time": datetime.fromtimestamp(snap["activity_time"]),
+        "type": ACTIVITY_TYPES[int(snap["activity_type"])],
+    }
+
+# ==========================================================
+# RPC TRANSPORT
+# ==========================================================
+def rpc_origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+class PoolStatsMixin:
+    """Đếm connection đang checkout, peak và số lần vượt maxsize (overflow).
+
+    Với pool_block=False, urllib3 mở thêm connection khi pool cạn rồi bỏ đi
+    lúc trả về ("Connection pool is full, discarding connection") - đó là
+    lúc pool bão hòa, nên đếm ngay khi checkout thay vì lấy mẫu sau.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = Lock()
+        self.pool_maxsize = self.pool.maxsize
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.overflow = 0
+        self.last_used = 0.0
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        with self.stats_lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self.in_use > self.pool_maxsize:
+                self.overflow += 1
+            self.last_used = time.time()
+        return conn
+
+    def _put_conn(self, conn):
+        with self.stats_lock:
+            self.in_use = max(self.in_use - 1, 0)
+            self.last_used = time.time()
+        super()._put_conn(conn)
+
+class StatsHTTPConnectionPool(PoolStatsMixin, HTTPConnectionPool):
+    pass
+
+class StatsHTTPSConnectionPool(PoolStatsMixin, HTTPSConnectionPool):
+    pass
+
+class StatsHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": StatsHTTPConnectionPool,
+            "https": StatsHTTPSConnectionPool,
+        }
+
+    def stats_pools(self) -> list:
+        pools = self.poolmanager.pools
+        return [p for p in (pools.get(k) for k in pools.keys()) if p is not None]
+
+class RpcTransport:
+    """Session dùng chung với connection pool riêng cho từng RPC host.
+
+    Mỗi host có adapter riêng (keep-alive); các host dự phòng được giữ ấm
+    trong background để _switch_rpc không phải mở TLS connection mới.
+    """
+    def __init__(self, user_agent: str):
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': user_agent})
+        self.endpoints = [(url, "getHealth") for url in RPC_SOL_LIST] + \
+                         [(url, "eth_chainId") for url in RPC_BSC_LIST]
+        self.adapters: Dict[str, StatsHTTPAdapter] = {}
+        for url, _ in self.endpoints:
+            origin = rpc_origin(url)
+            adapter = StatsHTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_MAXSIZE)
+            self.session.mount(origin, adapter)
+            self.adapters[origin] = adapter
+
+    def _warm(self, url: str, method: str) -> bool:
+        payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": []}
+        try:
+            r = self.session.post(url, json=payload, timeout=RPC_WARMUP_TIMEOUT_SEC)
+            return r.status_code < 500
+        except Exception:
+            return False
+
+    def idle_seconds(self, origin: str) -> float:
+        pools = self.adapters[origin].stats_pools()
+        if not pools:
+            return float("inf")
+        return time.time() - max(p.last_used for p in pools)
+
+    def warm_standby(self, active: set) -> tuple:
+        """Pre-connect tới các host không active và idle quá RPC_KEEPALIVE_INTERVAL_SEC.
+        Trả về (số host phản hồi, số host đã thử)"""
+        ok = tried = 0
+        for url, method in self.endpoints:
+            origin = rpc_origin(url)
+            if origin in active or self.idle_seconds(origin) < RPC_KEEPALIVE_INTERVAL_SEC:
+                continue
+            tried += 1
+            ok += self._warm(url, method)
+        return ok, tried
+
+    def get_pool_status(self) -> Dict[str, dict]:
+        status = {}
+        for origin, adapter in self.adapters.items():
+            pools = adapter.stats_pools()
+            overflow = sum(p.overflow for p in pools)
+            status[urlsplit(origin).netloc] = {
+                "in_use": sum(p.in_use for p in pools),
+                "peak": max((p.peak_in_use for p in pools), default=0),
+                "maxsize": RPC_POOL_MAXSIZE,
+                "overflow": overflow,
+                "opened": sum(p.num_connections for p in pools),
+                "requests": sum(p.num_requests for p in pools),
+                "saturated": overflow > 0,
+            }
+        return status
 
 # ==========================================================
 # SELF-PING KEEPER
@@ -130,6 +340,7 @@ class SelfPingKeeper:
             if r.status_code == 200:
                 self.ping_count += 1
                 log.info("🏓 Self-ping OK (#%d)", self.ping_count)
+                update_activity("ping")
             else:
                 self.fail_count += 1
                 log.warning("⚠️ Self-ping failed: %d", r.status_code)
@@ -500,6 +711,7 @@ app = Flask(__name__)
 
 @app.route('/')
 def health_check():
+    last_activity = get_last_activity()
     uptime = (datetime.now() - last_activity["time"]).total_seconds()
     return {
         "status": "online",
@@ -507,21 +719,49 @@ def health_check():
         "time": now_str(),
         "last_activity": last_activity["type"],
         "seconds_since_activity": int(uptime),
-        "healthy": uptime < 300
+        "healthy": uptime < 300 and watcher_alive()
     }
 
 @app.route('/health')
 def health():
-    uptime = (datetime.now() - last_activity["time"]).total_seconds()
+    if not watcher_alive():
+        return {"status": "watcher_down"}, 503
+    uptime = (datetime.now() - get_last_activity()["time"]).total_seconds()
     if uptime > 300:
         return {"status": "degraded"}, 503
     return {"status": "healthy", "uptime": int(uptime)}
 
 @app.route('/ping')
 def ping():
-    update_activity("ping")
+    """Ở prod mode route chạy trong gunicorn worker nên không ghi activity;
+    watcher tự ghi "ping" khi self-ping thành công (SelfPingKeeper)"""
+    if shared_state.is_writer():
+        update_activity("ping")
     return {"pong": now_str()}
 
+@app.route('/metrics')
+def metrics():
+    snap = shared_state.read()
+    return {
+        "sol": {"success": int(snap["sol_success"]), "fail": int(snap["sol_fail"])},
+        "bsc": {"success": int(snap["bsc_success"]), "fail": int(snap["bsc_fail"])},
+        "telegram_sent": int(snap["telegram_sent"]),
+        "rpc_pool": {"peak": int(snap["rpc_pool_peak"]), "overflow": int(snap["rpc_pool_overflow"])},
+        "seconds_since_activity": int(time.time() - snap["activity_time"]),
+    }
+
+def publish_metrics(sol: "SolanaReader", bsc: "BscReader", tele: "TelegramClient",
+                    transport: RpcTransport):
+    """Đẩy counters của watcher vào shared snapshot cho /metrics"""
+    pools = transport.get_pool_status().values()
+    shared_state.update(
+        sol_success=sol.success_count, sol_fail=sol.fail_count,
+        bsc_success=bsc.success_count, bsc_fail=bsc.fail_count,
+        telegram_sent=tele.send_count,
+        rpc_pool_peak=max((st["peak"] for st in pools), default=0),
+        rpc_pool_overflow=sum(st["overflow"] for st in pools),
+    )
+
 # ==========================================================
 # SELF-PING THREAD
 # ==========================================================
@@ -546,6 +786,24 @@ def run_self_pinger():
             log.exception("❌ Self-ping keeper error: %s", e)
             time.sleep(30)
 
+# ==========================================================
+# RPC KEEP-ALIVE THREAD
+# ==========================================================
+def run_rpc_keeper(transport: RpcTransport, readers: list):
+    """Thread riêng giữ ấm connection tới các RPC host dự phòng (bỏ qua host đang dùng)"""
+    first = True
+    while True:
+        try:
+            active = {rpc_origin(r._get_current_rpc()) for r in readers}
+            ok, tried = transport.warm_standby(active)
+            if first:
+                log.info("🔌 RPC standby pools warmed: %d/%d endpoints", ok, tried)
+                first = False
+        except Exception as e:
+            log.exception("❌ RPC keeper error: %s", e)
+        if shutdown_event.wait(RPC_KEEPALIVE_INTERVAL_SEC):
+            break
+
 # ==========================================================
 # WATCHDOG THREAD
 # ==========================================================
@@ -553,14 +811,18 @@ def run_watchdog():
     start_time = datetime.now()
     
     try:
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'ROAM-Watchdog/2.0'})
+        transport = RpcTransport('ROAM-Watchdog/2.0')
+        session = transport.session
         
         tele = TelegramClient(session)
         sol = SolanaReader(session)
         bsc = BscReader(session)
         bsc_watch = BscTransferWatcher(bsc)
 
+        keeper_thread = Thread(target=run_rpc_keeper, args=(transport, [sol, bsc]),
+                               daemon=True, name="RpcKeeperThread")
+        keeper_thread.start()
+
         log.info("🔄 Fetching initial data...")
         
         last_sol = Decimal("0")
@@ -635,8 +897,16 @@ def run_watchdog():
                     log.info("💓 Heartbeat | Uptime: %.1fh | SOL: ✅%d ❌%d | BSC: ✅%d ❌%d", 
                            uptime_hours, sol_health['success'], sol_health['fail'],
                            bsc_health['success'], bsc_health['fail'])
+                    pools = transport.get_pool_status()
+                    saturated = [f"{host} (overflow {st['overflow']})"
+                                 for host, st in pools.items() if st["saturated"]]
+                    log.info("🔌 RPC pools | opened: %d | peak: %d/%d | saturated: %s",
+                           sum(st["opened"] for st in pools.values()),
+                           max(st["peak"] for st in pools.values()), RPC_POOL_MAXSIZE,
+                           ", ".join(saturated) or "none")
                     last_heartbeat = current_time
 
+                publish_metrics(sol, bsc, tele, transport)
                 time.sleep(POLL_INTERVAL_SEC)
 
             except KeyboardInterrupt:
@@ -661,6 +931,96 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
+# ==========================================================
+# PRODUCTION SERVING (gunicorn + watcher process)
+# ==========================================================
+def run_watcher_process():
+    """Entry point của watcher process: self-pinger thread + watchdog loop"""
+    shared_state.claim_writer()
+    pinger_thread = Thread(target=run_self_pinger, daemon=True, name="SelfPingerThread")
+    pinger_thread.start()
+    run_watchdog()
+
+def serve_production():
+    """Chạy HTTP layer bằng gunicorn, watcher ở process riêng.
+
+    Watcher không còn tranh GIL với request handlers; state dùng chung qua
+    shared_state (tạo trước khi fork nên cả watcher lẫn workers đều thấy).
+    Watcher được fork và fork lại khi chết từ main loop của arbiter
+    (manage_workers), cùng chỗ gunicorn fork workers. Arbiter reap mọi child
+    bằng waitpid(-1), nên không dùng multiprocessing.Process (is_alive() sẽ
+    sai sau khi arbiter reap).
+    """
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+
+    def spawn_watcher() -> int:
+        pid = os.fork()
+        if pid == 0:
+            # Bỏ signal handlers của arbiter được kế thừa khi fork
+            for s in Arbiter.SIGNALS + [signal.SIGCHLD]:
+                signal.signal(s, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal_handler)
+            signal.signal(signal.SIGTERM, signal_handler)
+            try:
+                run_watcher_process()
+            finally:
+                os._exit(0)
+        log.info("✅ Watcher process started (pid=%d)", pid)
+        return pid
+
+    def watcher_exited(pid: int) -> bool:
+        try:
+            wpid, _ = os.waitpid(pid, os.WNOHANG)
+            return wpid != 0
+        except ChildProcessError:
+            return True  # Đã bị arbiter reap
+
+    class WatchdogArbiter(Arbiter):
+        watcher_pid = 0
+        watcher_checked = 0.0
+
+        def manage_workers(self):
+            now = time.time()
+            if not self.watcher_pid:
+                self.watcher_pid = spawn_watcher()
+                self.watcher_checked = now
+            elif now - self.watcher_checked >= WATCHER_CHECK_INTERVAL_SEC:
+                self.watcher_checked = now
+                if watcher_exited(self.watcher_pid):
+                    log.error("❌ Watcher process (pid=%d) died, restarting", self.watcher_pid)
+                    self.watcher_pid = spawn_watcher()
+            super().manage_workers()
+
+    def on_exit(server):
+        pid = server.watcher_pid
+        if not pid or watcher_exited(pid):
+            return
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.time() + POLL_INTERVAL_SEC + 5
+        while time.time() < deadline:
+            if watcher_exited(pid):
+                break
+            time.sleep(0.5)
+        else:
+            os.kill(pid, signal.SIGKILL)
+        log.info("👋 Watcher process stopped")
+
+    class WatchdogApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"0.0.0.0:{PORT}")
+            self.cfg.set("workers", WEB_CONCURRENCY)
+            self.cfg.set("on_exit", on_exit)
+
+        def load(self):
+            return app
+
+        def run(self):
+            WatchdogArbiter(self).run()
+
+    log.info("🌐 Starting gunicorn on 0.0.0.0:%d (%d workers)", PORT, WEB_CONCURRENCY)
+    WatchdogApplication().run()
+
 # ==========================================================
 # MAIN
 # ==========================================================
@@ -669,6 +1029,10 @@ def main():
     log.info("🚀 ROAM WATCHDOG v2.1 (Continuous)")
     log.info("=" * 60)
     log.info("🌐 Service URL: %s", RENDER_EXTERNAL_URL)
+
+    if SERVE_MODE == "prod":
+        serve_production()
+        return
     
     # Start self-ping keeper thread
     pinger_thread = Thread(target=run_self_pinger, daemon=True, name="SelfPingerThread")